@@ -1,16 +1,23 @@
 # coding=utf-8
 import logging
+import threading
 import weakref
+from concurrent.futures import ThreadPoolExecutor, Future
 from io import BytesIO
 from requests import Session, HTTPError
 from textwrap import dedent
+from typing import Any, Dict, Iterator, List, Optional
+from lxml import etree  # type: ignore
 import questionary  # type: ignore
 
-from .util import get_diff
+from .util import get_diff, InstitutionLogAdapter, RateLimiter
 from .bib import Bib
 
 log = logging.getLogger(__name__)
 
+# Only one thread at a time may ask the user a question, since they share the terminal
+prompt_lock = threading.Lock()
+
 
 class LibrarySystem(object):
 
@@ -25,7 +32,10 @@ class Alma(LibrarySystem):
 
     name = None
 
-    def __init__(self, api_region: str, api_key: str, delivery_url_template: str = None, dry_run: bool = False):
+    def __init__(self, api_region: str, api_key: str, delivery_url_template: str = None, dry_run: bool = False,
+                 rate_limit: Optional[float] = None, name: Optional[str] = None):
+        self.name = name
+        self.log = InstitutionLogAdapter(log, {'institution': name})
         self.dry_run = dry_run
         self.api_region = api_region
         self.api_key = api_key
@@ -33,11 +43,17 @@ class Alma(LibrarySystem):
         self.session.headers.update({'Authorization': 'apikey %s' % api_key})
         self.base_url = 'https://api-{region}.hosted.exlibrisgroup.com/almaws/v1'.format(region=self.api_region)
         self.delivery_url_template = delivery_url_template
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
 
     def url(self, path: str, **kwargs) -> str:
         return self.base_url.rstrip('/') + '/' + path.lstrip('/').format(**kwargs)
 
+    def throttle(self) -> None:
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+
     def get(self, url: str, **kwargs):
+        self.throttle()
         return self.session.get(self.url(url), **kwargs)
 
     def get_record(self, record_id: str) -> Bib:
@@ -54,44 +70,112 @@ class Alma(LibrarySystem):
                                % (record.id, record_id))
         return record
 
-    def put_record(self, record: Bib, show_diff: bool = False):
+    def get_records(self, record_ids: List[str]) -> List[Bib]:
+        """
+        Get up to 100 Bib records from Alma in a single request.
+        Records that don't exist are left out of the result.
+        """
+        if len(record_ids) > 100:
+            raise ValueError('Alma only supports fetching up to 100 records at a time')
+        response = self.get('/bibs', params={'mms_id': ','.join(record_ids)})
+        response.raise_for_status()
+        doc = etree.fromstring(response.content)
+        return [Bib(weakref.ref(self), etree.tounicode(node)) for node in doc.findall('bib')]
+
+    def get_set_members(self, set_id: str, limit: int = 100) -> Iterator[str]:
+        """
+        Iterate over the member IDs of an Alma set, page by page.
+
+        The next page is fetched in a background thread while the current page
+        is being consumed, so the set is never held in memory as a whole.
+
+        Args:
+            set_id: The Alma set ID
+            limit: Number of members to request per page (max 100)
+        """
+        # Use a separate session for the prefetch thread, so it doesn't share
+        # a connection pool with requests made from the main thread.
+        session = Session()
+        session.headers.update(self.session.headers)
+        session.headers.update({'Accept': 'application/json'})
+        url = self.url('/conf/sets/{set_id}/members', set_id=set_id)
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            self.throttle()
+            response = session.get(url, params={'limit': limit, 'offset': offset})
+            response.raise_for_status()
+            return response.json()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            offset = 0
+            page: Optional[Future] = executor.submit(fetch_page, offset)
+            while page is not None:
+                data = page.result()
+                members = data.get('member') or []
+                total = int(data.get('total_record_count') or 0)
+                offset += limit
+                if len(members) > 0 and offset < total:
+                    page = executor.submit(fetch_page, offset)
+                else:
+                    page = None
+                for member in members:
+                    yield str(member['id'])
+
+    def put_record(self, record: Bib, show_diff: bool = False, raise_errors: bool = False) -> bool:
         """
         Store a Bib record to Alma
 
         Args:
             record: The Bib object
             show_diff: Whether to print a diff before saving
+            raise_errors: Whether to re-raise an HTTPError after logging it
+
+        Returns:
+            True if the record was saved, False if it was skipped, not saved because
+            of dry run, or failed to save.
         """
         if record.cz_id is not None:
-            log.warning(dedent(
-                '''\
-                Encountered a Community Zone record. Updating such records through the API will
-                currently cause them to be de-linked from CZ, which is probably not what you want.
-                Until Ex Libris fixes this, you're best off editing the record manually in Alma.\
-                '''))
-
-            if not questionary.confirm('Do you want to update the record and break CZ linkage?', default=False).ask():
-                log.warning(' -> Skipping this record. You should update it manually in Alma!')
-                return
-
-            log.warning(' -> Updating the record. The CZ connection will be lost!')
+            with prompt_lock:
+                self.log.warning(dedent(
+                    '''\
+                    Record %s is a Community Zone record. Updating such records through the API will
+                    currently cause them to be de-linked from CZ, which is probably not what you want.
+                    Until Ex Libris fixes this, you're best off editing the record manually in Alma.\
+                    '''), record.id)
+
+                question = 'Do you want to update record %s and break CZ linkage?' % record.id
+                if self.name is not None:
+                    question = '[%s] %s' % (self.name, question)
+                if not questionary.confirm(question, default=False).ask():
+                    self.log.warning(' -> Skipping this record. You should update it manually in Alma!')
+                    return False
+
+                self.log.warning(' -> Updating the record. The CZ connection will be lost!')
 
         post_data = record.xml()
         if show_diff:
             the_diff = ''.join(get_diff(record.orig_xml, post_data))
-            log.info('Diff:\n%s', the_diff)
-
-        if not self.dry_run:
-            try:
-                response = self.session.put(self.url('/bibs/{mms_id}', mms_id=record.id),
-                                            data=BytesIO(post_data.encode('utf-8')),
-                                            headers={'Content-Type': 'application/xml'})
-                response.raise_for_status()
-                record.init(response.text)
-
-            except HTTPError:
-                msg = '*** Failed to save record %s --- Please try to edit the record manually in Alma ***'
-                log.error(msg, record.id)
+            self.log.info('Diff:\n%s', the_diff)
+
+        if self.dry_run:
+            return False
+
+        try:
+            self.throttle()
+            response = self.session.put(self.url('/bibs/{mms_id}', mms_id=record.id),
+                                        data=BytesIO(post_data.encode('utf-8')),
+                                        headers={'Content-Type': 'application/xml'})
+            response.raise_for_status()
+            record.init(response.text)
+
+        except HTTPError:
+            msg = '*** Failed to save record %s --- Please try to edit the record manually in Alma ***'
+            self.log.error(msg, record.id)
+            if raise_errors:
+                raise
+            return False
+
+        return True
 
     def get_delivery_url(self, bib: Bib) -> str:
         # Get delivery url
@@ -0,0 +1,150 @@
+# coding=utf-8
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from .data import Table
+
+if TYPE_CHECKING:
+    from .alma import Alma
+    from .urn_service import UrnService
+
+# Fields that should have a value in every row. The NZ ID is only set if the record exists in the network zone.
+REQUIRED_FIELDS = ['urn', 'alma_iz_id', 'alma_representation_id', 'url', 'title']
+
+# Fields that should be unique across the table
+UNIQUE_FIELDS = ['urn', 'alma_iz_id', 'alma_nz_id', 'url']
+
+# Number of records to fetch from Alma per request (max 100)
+ALMA_BATCH_SIZE = 100
+
+
+class Auditor(object):
+    """
+    Checks the data table for duplicate URNs, MMS IDs and URLs, URLs that don't match
+    the delivery URL template and rows with missing fields.
+
+    Rows are identified by row number in the report, counting from 1 for the first data row.
+    Blank lines are not counted, and a row with a multi-line quoted value counts as one row,
+    so row numbers don't always match line numbers in the CSV file.
+    """
+
+    def __init__(self, table: Table, delivery_url_template: Optional[str] = None) -> None:
+        self.table = table
+        self.delivery_url_template = delivery_url_template
+
+    def audit(self) -> Dict[str, Any]:
+        """
+        Check all rows in a single pass and return the report.
+        """
+        fieldnames = self.table.fieldnames
+        pos = {key: fieldnames.index(key) for key in fieldnames}
+        unique = [(key, pos[key]) for key in UNIQUE_FIELDS]
+        required = [(key, pos[key]) for key in REQUIRED_FIELDS]
+
+        # Map each value to the first row it was seen in, and only keep lists of rows for values seen more than once
+        first_seen: Dict[str, Dict[str, int]] = {key: {} for key in UNIQUE_FIELDS}
+        duplicates: Dict[str, Dict[str, List[int]]] = {key: {} for key in UNIQUE_FIELDS}
+        issues: List[Dict[str, Any]] = []
+        n_rows = 0
+
+        for row_number, values in enumerate(self.table.tuples(), start=1):
+            n_rows += 1
+            mms_id = values[pos['alma_iz_id']]
+
+            missing = [key for key, idx in required if values[idx] == '']
+            if len(missing) > 0:
+                issues.append({'type': 'missing_fields', 'row_numbers': [row_number], 'alma_iz_ids': [mms_id], 'fields': missing})
+
+            for key, idx in unique:
+                value = values[idx]
+                if value == '':
+                    continue
+                seen = first_seen[key].setdefault(value, row_number)
+                if seen != row_number:
+                    duplicates[key].setdefault(value, [seen]).append(row_number)
+
+            url = values[pos['url']]
+            if self.delivery_url_template is not None and url != '':
+                expected = self.delivery_url_template.format(
+                    mms_id=mms_id,
+                    representation_id=values[pos['alma_representation_id']]
+                )
+                if url != expected:
+                    issues.append({'type': 'url_mismatch', 'row_numbers': [row_number], 'alma_iz_ids': [mms_id],
+                                   'url': url, 'expected_url': expected})
+
+        for key in UNIQUE_FIELDS:
+            for value, row_numbers in duplicates[key].items():
+                issues.append({
+                    'type': 'duplicate_%s' % key,
+                    'row_numbers': row_numbers,
+                    'alma_iz_ids': [self.table.get_value(row_number - 1, 'alma_iz_id') for row_number in row_numbers],
+                    'value': value,
+                })
+
+        summary: Dict[str, int] = {}
+        for issue in issues:
+            summary[issue['type']] = summary.get(issue['type'], 0) + 1
+
+        return {
+            'filename': self.table.filename,
+            'rows': n_rows,
+            'issues': issues,
+            'summary': summary,
+        }
+
+    def confirm(self, report: Dict[str, Any], alma: 'Alma', urn: 'UrnService', max_workers: int = 8) -> None:
+        """
+        Look up the rows flagged in the report in Alma and the URN service, and add the results
+        to the report under 'confirmations'. Alma records are fetched in batches, and the
+        batches and URN lookups run concurrently.
+        """
+        row_numbers = sorted({row_number for issue in report['issues'] for row_number in issue['row_numbers']})
+        rows = [self.table.rows[row_number - 1] for row_number in row_numbers]
+        mms_ids = sorted({row['alma_iz_id'] for row in rows if row['alma_iz_id'] != ''})
+        urns = sorted({row['urn'] for row in rows if row['urn'] != ''})
+        batches = [mms_ids[i:i + ALMA_BATCH_SIZE] for i in range(0, len(mms_ids), ALMA_BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            bib_batches = executor.map(lambda batch: self.lookup_bibs(alma, batch), batches)
+            urn_targets = executor.map(lambda value: self.lookup_urn(urn, value), urns)
+            bibs: Dict[str, Dict[str, Any]] = {}
+            for batch in bib_batches:
+                bibs.update(batch)
+            targets = dict(zip(urns, urn_targets))
+
+        confirmations = []
+        for row_number, row in zip(row_numbers, rows):
+            bib = bibs.get(row['alma_iz_id'], {'exists': False, 'urn': None, 'error': None})
+            target = targets.get(row['urn'], {'url': None, 'error': None})
+            confirmations.append({
+                'row_number': row_number,
+                'alma_iz_id': row['alma_iz_id'],
+                'alma_exists': bib['exists'],
+                'alma_urn': bib['urn'],
+                'alma_urn_matches': bib['urn'] is not None and bib['urn'] == row['urn'],
+                'urn_target': target['url'],
+                'urn_target_matches': target['url'] is not None and target['url'] == row['url'],
+                'errors': [err for err in [bib['error'], target['error']] if err is not None],
+            })
+        report['confirmations'] = confirmations
+
+    @staticmethod
+    def lookup_bibs(alma: 'Alma', mms_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            records = alma.get_records(mms_ids)
+        except Exception as err:  # Report the error for the whole batch rather than failing the audit
+            return {mms_id: {'exists': None, 'urn': None, 'error': 'Alma: %s' % err} for mms_id in mms_ids}
+        result: Dict[str, Dict[str, Any]] = {
+            mms_id: {'exists': False, 'urn': None, 'error': None} for mms_id in mms_ids
+        }
+        for bib in records:
+            result[bib.id] = {'exists': True, 'urn': bib.marc_record.get_urn(), 'error': None}
+        return result
+
+    @staticmethod
+    def lookup_urn(urn: 'UrnService', value: str) -> Dict[str, Any]:
+        try:
+            return {'url': urn.get_url(value), 'error': None}
+        except Exception as err:
+            return {'url': None, 'error': 'URN service: %s' % err}
@@ -1,10 +1,32 @@
 import os
-from typing import Dict, Union, Optional
+from typing import Any, Dict, Optional
 from dotenv import load_dotenv  # type: ignore
 load_dotenv('.env')
 
 
-def config() -> Dict[str, Union[str, Dict[str, Optional[str]]]]:
+def getenv_float(key: str) -> Optional[float]:
+    value = os.getenv(key)
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def institution_config(name: str) -> Dict[str, Any]:
+    # Settings for a named institution zone, e.g. ALMA_API_KEY_UBO for the 'ubo' profile
+    suffix = name.upper()
+    return {
+        'data_file': os.getenv('SATURN_DATA_FILE_' + suffix, 'saturn-data-%s.csv' % name.lower()),
+        'alma_iz': {
+            'api_region': os.getenv('ALMA_API_REGION_' + suffix, 'eu'),
+            'api_key': os.getenv('ALMA_API_KEY_' + suffix),
+            'delivery_url_template': os.getenv('ALMA_DELIVERY_URL_TEMPLATE_' + suffix),
+            'rate_limit': getenv_float('ALMA_RATE_LIMIT_' + suffix),
+        },
+    }
+
+
+def config() -> Dict[str, Any]:
+    institutions = [name.strip() for name in os.getenv('SATURN_INSTITUTIONS', '').split(',') if name.strip() != '']
     return {
         'default_data_file': 'saturn-data.csv',
         'urn': {
@@ -14,13 +36,15 @@ def config() -> Dict[str, Union[str, Dict[str, Optional[str]]]]:
             'password': os.getenv('URN_PASSWORD'),
         },
         'alma_iz': {
-            'api_region': 'eu',
+            'api_region': os.getenv('ALMA_API_REGION', 'eu'),
             'api_key': os.getenv('ALMA_API_KEY'),
             'delivery_url_template': os.getenv('ALMA_DELIVERY_URL_TEMPLATE', 'https://bibsys.alma.exlibrisgroup.com/view/delivery/47BIBSYS_UBO/{mms_id}'),
         },
         'alma_nz': {
-            'api_region': 'eu',
+            'api_region': os.getenv('ALMA_API_REGION_NZ', 'eu'),
             'api_key': os.getenv('ALMA_API_KEY_NZ'),
-        }
+            'rate_limit': getenv_float('ALMA_RATE_LIMIT_NZ'),
+        },
+        'institutions': {name: institution_config(name) for name in institutions},
     }
 
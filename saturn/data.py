@@ -1,79 +1,235 @@
 import csv
+import gc
 import os
-from typing import Optional, List, Dict
-from collections import OrderedDict
+from collections.abc import MutableMapping, Sequence
+from itertools import islice
+from operator import add, methodcaller
+from sys import intern
+from typing import Optional, List, Dict, Iterator, Iterable, Tuple
 
-# Using Dict instead of OrderedDict because the latter will fail with Pytho 3.6
-# See: https://stackoverflow.com/a/43583996/489916
-Rows = List[Dict[str, str]]
+FIELDNAMES = [
+    'urn',
+    'alma_iz_id',
+    'alma_nz_id',
+    'alma_representation_id',
+    'url',
+    'title',
+]
+
+# Number of CSV rows to read at a time when loading a table
+CHUNK_SIZE = 10000
 
 
 class RowNotFound(RuntimeError):
     pass
 
 
-class Table(object):
+class Row(MutableMapping):
+    """
+    A dict-like view of a single row in a Table, e.g. row['urn'].
+    Changes are written directly to the table.
+    """
+
+    __slots__ = ('_table', '_idx')
+
+    def __init__(self, table: 'Table', idx: int) -> None:
+        self._table = table
+        self._idx = idx
+
+    def __getitem__(self, key: str) -> str:
+        return self._table.get_value(self._idx, key)
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self._table.set_value(self._idx, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError('Cannot delete fields from a row')
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FIELDNAMES)
+
+    def __len__(self) -> int:
+        return len(FIELDNAMES)
+
+    def __repr__(self) -> str:
+        return 'Row(%r)' % dict(self)
+
+
+class Rows(Sequence):
+    """ A list-like view of the rows in a Table """
 
-    fieldnames = [
-        'urn',
-        'alma_iz_id',
-        'alma_nz_id',
-        'alma_representation_id',
-        'url',
-        'title',
-    ]
+    __slots__ = ('_table',)
+
+    def __init__(self, table: 'Table') -> None:
+        self._table = table
+
+    def __getitem__(self, idx):  # type: ignore
+        if isinstance(idx, slice):
+            return [Row(self._table, i) for i in range(len(self))[idx]]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Row index out of range')
+        return Row(self._table, idx)
+
+    def __len__(self) -> int:
+        return len(self._table.columns['alma_iz_id'])
+
+
+class Table(object):
+    """
+    The data table. Values are stored column by column rather than as one dict per row,
+    to keep large tables small and fast to load. Values that repeat across rows
+    (NZ IDs and URL prefixes up to the last slash) are interned, so each distinct value
+    is only stored once. Use `rows` to get dict-like views of the rows.
+    """
+
+    fieldnames = FIELDNAMES
     filename = None
 
     def __init__(self) -> None:
-        self._rows: Rows = []
+        self.columns: Dict[str, List[str]] = {}
+        self._url_prefixes: List[str] = []
+        self._index: Optional[Dict[str, int]] = None
+        self.clear()
+
+    def clear(self) -> None:
+        # Note: The 'url' column only holds what comes after the URL prefix
+        self.columns = {key: [] for key in self.fieldnames}
+        self._url_prefixes = []
+        self._index = None
+
+    def get_value(self, idx: int, key: str) -> str:
+        if key == 'url':
+            return self._url_prefixes[idx] + self.columns['url'][idx]
+        return self.columns[key][idx]
+
+    def set_value(self, idx: int, key: str, value: str) -> None:
+        if key == 'url':
+            prefix, sep, suffix = value.rpartition('/')
+            self._url_prefixes[idx] = intern(prefix + sep)
+            self.columns['url'][idx] = suffix
+        elif key == 'alma_nz_id':
+            self.columns[key][idx] = intern(value)
+        else:
+            if key == 'alma_iz_id' and self.columns[key][idx] != value:
+                self._index = None
+            self.columns[key][idx] = value
+
+    def append_rows(self, rows: List[List[str]]) -> None:
+        """ Append rows, given as lists of values in the order of `fieldnames` """
+        if len(rows) == 0:
+            return
+        first_idx = len(self.columns['alma_iz_id'])
+        values = list(zip(*rows))
+        for key, column in zip(self.fieldnames, values):
+            if key == 'url':
+                # The URLs usually share a prefix, so find that once for the whole chunk
+                # rather than splitting each URL.
+                prefix = self.url_prefix(url for url in column if url != '')
+                n = len(prefix)
+                matches = list(map(methodcaller('startswith', prefix), column))
+                self._url_prefixes.extend([prefix if match else '' for match in matches])
+                self.columns[key].extend([url[n:] if match else url for url, match in zip(column, matches)])
+            elif key == 'alma_nz_id':
+                self.columns[key].extend(map(intern, column))
+            else:
+                self.columns[key].extend(column)
+        if self._index is not None:
+            # Keep the index up to date rather than rebuilding it on the next lookup
+            for idx, mms_id in enumerate(self.columns['alma_iz_id'][first_idx:], start=first_idx):
+                self._index.setdefault(mms_id, idx)
+
+    @staticmethod
+    def url_prefix(urls: Iterable[str]) -> str:
+        # Return the common prefix of the given URLs, up to and including the last slash
+        prefix = os.path.commonprefix(list(urls))
+        return intern(prefix[:prefix.rfind('/') + 1])
 
     def open(self, filename: str) -> 'Table':
         self.filename = filename
-        rows: Rows = []
+        self.clear()
         if not os.path.exists(filename):
-            self._rows = rows
             return self
 
-        with open(filename) as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                rows.append(row)
-        self._rows = rows
+        # The row lists produced by csv.reader are tracked by the garbage collector, and
+        # collections triggered while loading a large file add a lot of overhead.
+        # Note that the toggle is process-wide and not thread-safe: if two threads load
+        # at the same time, one may re-enable collection while the other is still loading,
+        # or leave it disabled. Load tables from one thread only.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(filename, newline='') as csvfile:
+                # Plain csv.reader is a lot faster than csv.DictReader, and reading in chunks
+                # lets us transpose the rows into columns without a Python loop per row.
+                reader = csv.reader(csvfile)
+                header = next(reader, [])
+                columns = [header.index(key) if key in header else None for key in self.fieldnames]
+                reorder = header != self.fieldnames
+                for chunk in iter(lambda: list(islice(reader, CHUNK_SIZE)), []):
+                    if reorder or any(len(values) != len(header) for values in chunk):
+                        chunk = self.normalize_rows(chunk, columns)
+                    self.append_rows(chunk)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
         return self
 
+    @staticmethod
+    def normalize_rows(chunk: Iterable[List[str]], columns: List[Optional[int]]) -> List[List[str]]:
+        # Map columns to `fieldnames` order and fill in missing values. Blank lines are skipped,
+        # like csv.DictReader does.
+        return [
+            [values[idx] if idx is not None and idx < len(values) else '' for idx in columns]
+            for values in chunk
+            if len(values) != 0
+        ]
+
     @property
     def rows(self) -> Rows:
-        return self._rows
+        return Rows(self)
 
     def save(self, filename: Optional[str] = None) -> None:
         filename = filename or self.filename
         if filename is None:
             raise ValueError('No filename given')
 
-        with open(filename, 'w') as fp:
-            writer = csv.DictWriter(fp, fieldnames=self.fieldnames)
-            writer.writeheader()
-            writer.writerows(self.rows)
+        with open(filename, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(self.fieldnames)
+            writer.writerows(self.tuples())
+
+    def tuples(self) -> Iterator[Tuple[str, ...]]:
+        """ Iterate over the rows as tuples of values in the order of `fieldnames`. Faster than `rows`. """
+        columns: List[Iterable[str]] = [self.columns[key] for key in self.fieldnames]
+        columns[self.fieldnames.index('url')] = map(add, self._url_prefixes, self.columns['url'])
+        return zip(*columns)
+
+    @property
+    def index(self) -> Dict[str, int]:
+        # Maps IZ MMS ID to row index. If an MMS ID is repeated, the first row wins.
+        if self._index is None:
+            ids = self.columns['alma_iz_id']
+            self._index = dict(zip(reversed(ids), range(len(ids) - 1, -1, -1)))
+        return self._index
 
     def has(self, mms_id: str) -> bool:
-        for row in self.rows:
-            if row['alma_iz_id'] == mms_id:
-                return True
-        return False
-
-    def get(self, mms_id: str) -> Dict[str, str]:
-        for row in self.rows:
-            if row['alma_iz_id'] == mms_id:
-                return row
-        raise RowNotFound()
-
-    def add(self, mms_id: str, store: bool = True) -> OrderedDict:
+        return mms_id in self.index
+
+    def get(self, mms_id: str) -> Row:
+        try:
+            return Row(self, self.index[mms_id])
+        except KeyError:
+            raise RowNotFound()
+
+    def add(self, mms_id: str, store: bool = True) -> Row:
         if self.has(mms_id):
             raise ValueError('MMS ID already exists in DB')
 
-        row: OrderedDict[str, str] = OrderedDict([(x, '') for x in self.fieldnames])
-        row['alma_iz_id'] = mms_id
-        self.rows.append(row)
+        row = [mms_id if key == 'alma_iz_id' else '' for key in self.fieldnames]
+        self.append_rows([row])
+        idx = len(self.columns['alma_iz_id']) - 1
         if store:
             self.save()
-        return row
+        return Row(self, idx)
@@ -0,0 +1,227 @@
+# coding=utf-8
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, IO, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+OUTCOMES = ['ok', 'target_updated', 'urn_created', 'marc_updated', 'error']
+
+
+@contextmanager
+def timed(timings: Dict[str, float], phase: str) -> Iterator[None]:
+    """ Add the time spent in the block to timings[phase] """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+class ProgressReporter(object):
+    """
+    Reports progress for long runs as JSON lines (one event per record) and/or as a
+    Prometheus textfile snapshot written at a fixed interval.
+
+    Events are put on a queue and formatted and written by a background thread,
+    so reporting never blocks the caller on I/O.
+    """
+
+    def __init__(self, stream: Optional[IO[str]] = None, metrics_file: Optional[str] = None,
+                 metrics_interval: float = 15.0, window: float = 60.0) -> None:
+        """
+        Params:
+            stream: Where to write JSON lines. If None, no JSON lines are written.
+            metrics_file: Where to write the Prometheus textfile snapshot. If None, no snapshot is written.
+            metrics_interval: Seconds between each snapshot
+            window: Seconds to use for the rolling records/sec rate
+        """
+        self.stream = stream
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.window = window
+
+        # State below is only touched by the writer thread
+        self.started = time.monotonic()
+        self.expected = 0
+        self.processed = 0
+        self.outcomes: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+        self.phase_seconds: Dict[str, float] = {}
+        self.recent: Deque[float] = deque()
+        self.last_record_time: Optional[float] = None
+
+        self.queue: 'queue.Queue[Optional[Dict[str, Any]]]' = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='saturn-progress', daemon=True)
+        self.thread.start()
+
+    def expect(self, n_records: int) -> None:
+        """ Add to the number of records expected, used to estimate the time left """
+        self.queue.put({'event': 'expect', 'records': n_records})
+
+    def record(self, mms_id: str, outcome: str, timings: Dict[str, float],
+               institution: Optional[str] = None) -> None:
+        """ Report that a record has been processed """
+        self.queue.put({
+            'event': 'record',
+            'time': time.time(),
+            'monotonic': time.monotonic(),
+            'institution': institution,
+            'mms_id': mms_id,
+            'outcome': outcome,
+            'timings': timings,
+        })
+
+    def close(self) -> None:
+        """ Write the remaining events, a summary and a final snapshot, then stop the writer thread """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self) -> None:
+        next_snapshot = time.monotonic() + self.metrics_interval
+        done = False
+        while not done:
+            timeout = max(0.0, next_snapshot - time.monotonic()) if self.metrics_file is not None else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = {'event': 'tick'}
+
+            # Drain what's already queued, so the stream is written and flushed in batches
+            lines = []
+            while True:
+                if item is None:
+                    done = True
+                    break
+                line = self.handle(item)
+                if line is not None:
+                    lines.append(line)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if done:
+                lines.append(self.summary())
+            if self.stream is not None and len(lines) > 0:
+                self.write_lines(lines)
+
+            if self.metrics_file is not None and (done or time.monotonic() >= next_snapshot):
+                self.write_metrics()
+                next_snapshot = time.monotonic() + self.metrics_interval
+
+    def handle(self, item: Dict[str, Any]) -> Optional[str]:
+        if item['event'] == 'expect':
+            self.expected += item['records']
+            return None
+        if item['event'] != 'record':
+            return None
+
+        now = item.pop('monotonic')
+        self.processed += 1
+        self.outcomes[item['outcome']] = self.outcomes.get(item['outcome'], 0) + 1
+        for phase, seconds in item['timings'].items():
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+        self.last_record_time = item['time']
+        self.recent.append(now)
+
+        if self.stream is None:
+            return None
+        rate = self.rate(now)
+        item.update({
+            'duration': round(sum(item['timings'].values()), 4),
+            'timings': {phase: round(seconds, 4) for phase, seconds in item['timings'].items()},
+            'processed': self.processed,
+            'errors': self.outcomes['error'],
+            'records_per_sec': round(rate, 3),
+            'eta': self.eta(rate),
+        })
+        if item['institution'] is None:
+            del item['institution']
+        return json.dumps(item)
+
+    def rate(self, now: float) -> float:
+        # Rolling records/sec over the last `window` seconds. Records outside the window are
+        # dropped here rather than when a record arrives, so the rate falls if the run stalls.
+        while len(self.recent) > 0 and self.recent[0] < now - self.window:
+            self.recent.popleft()
+        elapsed = min(self.window, now - self.started)
+        if elapsed <= 0:
+            return 0.0
+        return len(self.recent) / elapsed
+
+    def eta(self, rate: float) -> Optional[float]:
+        # Estimated seconds left, if the number of records is known
+        if self.expected == 0 or rate == 0:
+            return None
+        return round(max(0, self.expected - self.processed) / rate, 1)
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        return json.dumps({
+            'event': 'summary',
+            'time': time.time(),
+            'processed': self.processed,
+            'errors': self.outcomes['error'],
+            'outcomes': self.outcomes,
+            'elapsed': round(elapsed, 3),
+            'records_per_sec': round(self.processed / elapsed, 3) if elapsed > 0 else 0.0,
+        })
+
+    def write_lines(self, lines: list) -> None:
+        try:
+            self.stream.write('\n'.join(lines) + '\n')  # type: ignore
+            self.stream.flush()  # type: ignore
+        except (OSError, ValueError):
+            log.exception('Failed to write progress, disabling progress output')
+            self.stream = None
+
+    def write_metrics(self) -> None:
+        rate = self.rate(time.monotonic())
+        lines = [
+            '# HELP saturn_records_processed_total Records processed, by outcome.',
+            '# TYPE saturn_records_processed_total counter',
+        ]
+        for outcome, count in self.outcomes.items():
+            lines.append('saturn_records_processed_total{outcome="%s"} %d' % (outcome, count))
+        lines += [
+            '# HELP saturn_phase_seconds_total Time spent processing records, by phase.',
+            '# TYPE saturn_phase_seconds_total counter',
+        ]
+        for phase, seconds in sorted(self.phase_seconds.items()):
+            lines.append('saturn_phase_seconds_total{phase="%s"} %f' % (phase, seconds))
+        lines += [
+            '# HELP saturn_records_per_second Rolling rate of records processed.',
+            '# TYPE saturn_records_per_second gauge',
+            'saturn_records_per_second %f' % rate,
+            '# HELP saturn_records_expected Number of records expected in this run.',
+            '# TYPE saturn_records_expected gauge',
+            'saturn_records_expected %d' % self.expected,
+        ]
+        eta = self.eta(rate)
+        if eta is not None:
+            lines += [
+                '# HELP saturn_eta_seconds Estimated time left.',
+                '# TYPE saturn_eta_seconds gauge',
+                'saturn_eta_seconds %f' % eta,
+            ]
+        if self.last_record_time is not None:
+            lines += [
+                '# HELP saturn_last_record_timestamp_seconds Time the last record was processed.',
+                '# TYPE saturn_last_record_timestamp_seconds gauge',
+                'saturn_last_record_timestamp_seconds %f' % self.last_record_time,
+            ]
+
+        # Write to a temporary file and rename, so the collector never sees a partial file
+        tmp_file = self.metrics_file + '.tmp'  # type: ignore
+        try:
+            with open(tmp_file, 'w') as fp:
+                fp.write('\n'.join(lines) + '\n')
+            os.replace(tmp_file, self.metrics_file)  # type: ignore
+        except OSError:
+            log.exception('Failed to write metrics to %s', self.metrics_file)
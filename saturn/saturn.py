@@ -4,16 +4,21 @@ import os
 import shutil
 import sys
 import argparse
+import json
 import yaml
 from requests.exceptions import HTTPError
 import logging
 import logging.config
 import pkg_resources
-from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple, TYPE_CHECKING
 
 from . import __version__
 from .alma import Alma
+from .audit import Auditor
 from .data import Table
+from .progress import ProgressReporter, timed
+from .util import InstitutionLogAdapter
 from .config import config
 from .urn_service import UrnService
 
@@ -27,16 +32,23 @@ with open(LOG_CONFIG_FILE) as fp:
 
 log = logging.getLogger()
 
+# Number of records to process between each save of the data table when adding many records
+SAVE_INTERVAL = 100
+
 
 class Saturn(object):
 
-    def __init__(self, cfg: dict) -> None:
+    def __init__(self, cfg: dict, urn: Optional[UrnService] = None, alma_nz: Optional[Alma] = None) -> None:
+        self.cfg = cfg
+        self.institution = cfg.get('institution')
+        self.log = InstitutionLogAdapter(log, {'institution': self.institution})
         self.default_data_file = cfg['default_data_file']
+        self.institutions = cfg.get('institutions', {})
         self.table = Table()
-        self.urn = UrnService(**cfg['urn'])
+        self.urn = urn or UrnService(**cfg['urn'])
         self.alma = {
-            'iz': Alma(**cfg['alma_iz']),
-            'nz': Alma(**cfg['alma_nz']),
+            'iz': Alma(name=self.institution, **cfg['alma_iz']),
+            'nz': alma_nz or Alma(**cfg['alma_nz']),
         }
 
     def run(self) -> None:
@@ -53,7 +65,7 @@ class Saturn(object):
                             default=self.default_data_file)
 
         subparsers = parser.add_subparsers(dest='action',
-                                           description='add, init or validate')
+                                           description='add, audit, init or validate')
 
         add_cmd = subparsers.add_parser('add')
         add_cmd.add_argument('--urn', dest='urn',
@@ -62,14 +74,35 @@ class Saturn(object):
                             help='Update URNs to match template.')
         add_cmd.add_argument('--update_marc_record', action='store_true', dest='update_marc_record',
                             help='Update MARC record')  # Skal? Skal ikke???
+        add_cmd.add_argument('--set', dest='set_id',
+                             help='Add all members of the given Alma set.')
         add_cmd.add_argument('records', nargs='*', help='Records to add or validate')
 
+        audit_cmd = subparsers.add_parser('audit')
+        audit_cmd.add_argument('--confirm', action='store_true', dest='confirm',
+                               help='Look up flagged rows in Alma and the URN service.')
+        audit_cmd.add_argument('-o', '--output', dest='output',
+                               help='Write the JSON report to this file. Default: stdout')
+
         init_cmd = subparsers.add_parser('init')
         validate_cmd = subparsers.add_parser('validate')
         validate_cmd.add_argument('--update_urns', action='store_true', dest='update_urns',
                                   help='Update URNs to match template.')
         validate_cmd.add_argument('--update_marc_record', action='store_true', dest='update_marc_record',
                                   help='Update MARC record')  # Skal? Skal ikke???
+        validate_cmd.add_argument('--set', dest='set_id',
+                                  help='Only validate members of the given Alma set.')
+        validate_cmd.add_argument('--all-institutions', action='store_true', dest='all_institutions',
+                                  help='Validate all institutions listed in SATURN_INSTITUTIONS in parallel.')
+        validate_cmd.add_argument('--progress-format', dest='progress_format', choices=['text', 'jsonl'],
+                                  default='text',
+                                  help='Use "jsonl" to write one JSON event per record. Default: text')
+        validate_cmd.add_argument('--progress-file', dest='progress_file',
+                                  help='Write JSON progress events to this file. Default: stderr')
+        validate_cmd.add_argument('--metrics-file', dest='metrics_file',
+                                  help='Write a Prometheus textfile snapshot to this file at a fixed interval.')
+        validate_cmd.add_argument('--metrics-interval', dest='metrics_interval', type=float, default=15.0,
+                                  help='Seconds between each metrics snapshot. Default: 15')
 
         args = parser.parse_args(sys.argv[1:])
 
@@ -87,6 +120,23 @@ class Saturn(object):
             return
 
         if action == 'add':
+            if args.set_id is not None:
+                if args.urn:
+                    parser.error('--urn cannot be combined with --set')
+                if len(args.records) > 0:
+                    parser.error('MMS IDs cannot be combined with --set')
+                try:
+                    n_added, n_failed = self.add_records(
+                        self.alma['iz'].get_set_members(args.set_id),
+                        update_urns=args.update_urns,
+                        update_marc_record=args.update_marc_record
+                    )
+                except HTTPError as err:
+                    self.log_set_error(args.set_id, err)
+                    sys.exit(1)
+                if n_failed > 0:
+                    sys.exit(1)
+                return
             if len(args.records) > 0:
                 try:
                     defaults = {}
@@ -107,28 +157,127 @@ class Saturn(object):
                     sys.exit(1)
             return
 
+        if action == 'audit':
+            report = self.audit(args.confirm)
+            if args.output is None:
+                print(json.dumps(report, indent=2))
+            else:
+                with open(args.output, 'w') as fp:
+                    json.dump(report, fp, indent=2)
+            if len(report['issues']) > 0:
+                sys.exit(1)
+            return
+
         if action == 'validate':
-            self.validate_records(args.update_urns, args.update_marc_record)
+            if args.all_institutions:
+                if args.set_id is not None:
+                    parser.error('--set cannot be combined with --all-institutions')
+                if len(self.institutions) == 0:
+                    parser.error('No institutions configured. Set SATURN_INSTITUTIONS in the .env file.')
+                for name, profile in self.institutions.items():
+                    if not profile['alma_iz']['api_key']:
+                        parser.error('No API key for institution "%s". Set ALMA_API_KEY_%s in the .env file.'
+                                     % (name, name.upper()))
+                    if not profile['alma_iz']['delivery_url_template']:
+                        parser.error('No delivery URL template for institution "%s". '
+                                     'Set ALMA_DELIVERY_URL_TEMPLATE_%s in the .env file.' % (name, name.upper()))
+            progress_file = None
+            if args.progress_format == 'jsonl' and args.progress_file is not None:
+                progress_file = open(args.progress_file, 'a')
+            progress = None
+            if args.progress_format == 'jsonl' or args.metrics_file is not None:
+                progress = ProgressReporter(
+                    stream=(progress_file or sys.stderr) if args.progress_format == 'jsonl' else None,
+                    metrics_file=args.metrics_file,
+                    metrics_interval=args.metrics_interval
+                )
+            failed = False
+            try:
+                if args.all_institutions:
+                    report = self.validate_institutions(args.update_urns, args.update_marc_record, progress)
+                    failed = any(result['error'] is not None or result['failed'] > 0 for result in report.values())
+                else:
+                    mms_ids = None
+                    if args.set_id is not None:
+                        mms_ids = self.alma['iz'].get_set_members(args.set_id)
+                    try:
+                        n_validated, n_failed = self.validate_records(
+                            args.update_urns, args.update_marc_record, mms_ids, progress
+                        )
+                    except HTTPError as err:
+                        if args.set_id is None:
+                            raise
+                        self.log_set_error(args.set_id, err)
+                        sys.exit(1)
+                    failed = n_failed > 0
+            finally:
+                if progress is not None:
+                    progress.close()
+                if progress_file is not None:
+                    progress_file.close()
+            if failed:
+                sys.exit(1)
             return
 
         print('Unknown action "%s", try saturn -h' % args.action)
 
-    def add_record(self, mms_id: str, defaults: dict) -> None:
+    def add_record(self, mms_id: str, defaults: dict, store: bool = True) -> None:
         """
         Add a new record to our database and create an URN for it none exist yet.
 
         Params:
             mms_id: Institutional zone MMS ID
+            store: Whether to save the data table after adding the record
         """
         if self.table.has(mms_id):
             print('Record already exists in the local database.')
             return
         self.alma['iz'].get_record(mms_id)  # Validate that the record exists in Alma
-        row = self.table.add(mms_id)
+        row = self.table.add(mms_id, store=store)
         for key, val in defaults.items():
             row[key] = val
 
-        log.info('Added %s to data table', mms_id)
+        self.log.info('Added %s to data table', mms_id)
+
+    def add_records(self, mms_ids: Iterable[str], update_urns: bool, update_marc_record: bool) -> Tuple[int, int]:
+        """
+        Add and update a stream of records, e.g. the members of an Alma set.
+        Records that fail are logged and skipped, so one bad record doesn't stop the rest.
+        Returns the number of records added and the number that failed.
+
+        The data table is saved every SAVE_INTERVAL records and at the end, rather than
+        after each record, since saving a large table is slow. New URNs are still saved
+        right away.
+
+        Params:
+            mms_ids: Institutional zone MMS IDs
+        """
+        n_added = 0
+        n_failed = 0
+        try:
+            for n, mms_id in enumerate(mms_ids, start=1):
+                try:
+                    self.add_record(mms_id, {}, store=False)
+                    self.update_record(mms_id, update_urns=update_urns, update_marc_record=update_marc_record,
+                                       store=False)
+                    n_added += 1
+                except HTTPError as err:
+                    self.log.error('%s: Alma API returned error %s %s',
+                                   mms_id, err.response.status_code, err.response.text)
+                    n_failed += 1
+                except RuntimeError as err:  # E.g. MMS ID mismatch or no digital representations
+                    self.log.error('%s: %s', mms_id, err)
+                    n_failed += 1
+                if n % SAVE_INTERVAL == 0:
+                    self.table.save()
+        finally:
+            self.table.save()
+        self.log.info('Added %d records, %d failed', n_added, n_failed)
+        return n_added, n_failed
+
+    def log_set_error(self, set_id: str, err: HTTPError) -> None:
+        self.log.error('Failed to fetch members of set %s. Alma API returned error %s %s',
+                       set_id, err.response.status_code, err.response.text)
 
     def update_row_from_bib(self, row, bib) -> None:
         if row['alma_nz_id'] == '':
@@ -146,32 +295,53 @@ class Saturn(object):
         if row['alma_nz_id'] != '':
             # If record exists in NZ, we need to update that record
             bib = self.alma['nz'].get_record(row['alma_nz_id'])
-            log.info('Found record for mms id %s', row['alma_nz_id'])
+            self.log.info('Found record for mms id %s', row['alma_nz_id'])
 
-    def update_record(self, mms_id: str, update_urns: bool, update_marc_record: bool) -> None:
+    def update_record(self, mms_id: str, update_urns: bool, update_marc_record: bool,
+                      timings: Optional[Dict[str, float]] = None, store: bool = True) -> str:
         """
         Validate an existing record in our database and create an URN for it none exist yet.
+        Returns the outcome: 'urn_created', 'target_updated', 'marc_updated' or 'ok'.
 
         Params:
             mms_id: Institutional zone MMS ID
+            timings: If given, the time spent in each phase is added to this dict
+            store: Whether to save the data table after updating the record. The table is
+                always saved right after a new URN is created.
         """
+        if timings is None:
+            timings = {}
+        outcome = 'ok'
         row = self.table.get(mms_id)
-        bib = self.alma['iz'].get_record(mms_id)
-        self.update_row_from_bib(row, bib)
+        with timed(timings, 'alma_get'):
+            bib = self.alma['iz'].get_record(mms_id)
+        with timed(timings, 'row_update'):
+            self.update_row_from_bib(row, bib)
 
         if row['urn'] == '':
-            row['urn'] = self.get_or_create_urn(bib, row['url'])
-            self.table.save()  # Save after each URN so we don't loose an URN if the MARC update fails
+            with timed(timings, 'urn_create'):
+                if bib.marc_record.get_urn() is None:
+                    outcome = 'urn_created'
+                row['urn'] = self.get_or_create_urn(bib, row['url'])
+            with timed(timings, 'save'):
+                self.table.save()  # Save after each URN so we don't loose an URN if the MARC update fails
 
-        self.check_urn_target(row['urn'], row['url'], update_urns)
+        with timed(timings, 'urn_check'):
+            if self.check_urn_target(row['urn'], row['url'], update_urns) and outcome == 'ok':
+                outcome = 'target_updated'
 
         # Add URN to either the network zone record or the institution zone record, if no NZ record is present.
         if update_marc_record:
-            self.add_urn_to_marc_record(bib, row['urn'])
+            with timed(timings, 'marc_update'):
+                if self.add_urn_to_marc_record(bib, row['urn']) and outcome == 'ok':
+                    outcome = 'marc_updated'
 
-        self.table.save()  # Save after each add to be safe
+        if store:
+            with timed(timings, 'save'):
+                self.table.save()  # Save after each add to be safe
+        return outcome
 
-    def check_urn_target(self, urn: str, url: str, update: bool) -> None:
+    def check_urn_target(self, urn: str, url: str, update: bool) -> bool:
         """
         Validate and optionally fix the target URL for a given URN.
 
@@ -179,23 +349,121 @@ class Saturn(object):
             - urn: The URN to check
             - url: The expected target URL for the given URN
             - update: Whether to update the URN if the target URL differs from the expected value
+
+        Returns True if the target URL was updated.
         """
         current_url = self.urn.get_url(urn)
         if current_url == url:
-            log.info('%s has the expected target URL', urn)
+            self.log.info('%s has the expected target URL', urn)
         elif update:
             self.urn.update(urn, current_url, url)
-            log.info('%s: Target URL updated from %s to %s', urn, current_url, url)
+            self.log.info('%s: Target URL updated from %s to %s', urn, current_url, url)
+            return True
         else:
-            log.warning('%s: Target URL %s differs from the expected %s. Use --update_urns to update.', urn, current_url, url)
+            self.log.warning('%s: Target URL %s differs from the expected %s. Use --update_urns to update.', urn, current_url, url)
+        return False
+
+    def validate_records(self, update_urns: bool, update_marc_record: bool,
+                         mms_ids: Optional[Iterable[str]] = None,
+                         progress: Optional[ProgressReporter] = None) -> Tuple[int, int]:
+        """
+        Validate all records and makes updates as needed.
+        Records that fail are logged and skipped, so one bad record doesn't stop the rest.
+        Returns the number of records validated and the number that failed.
+
+        Params:
+            mms_ids: Only validate these records (e.g. the members of an Alma set).
+                Default: all records in the data table.
+            progress: Report the outcome and timings for each record here
+        """
+        if mms_ids is None:
+            mms_ids = [row['alma_iz_id'] for row in self.table.rows]
+        if progress is not None and isinstance(mms_ids, list):
+            progress.expect(len(mms_ids))
+        n_validated = 0
+        n_failed = 0
+        for mms_id in mms_ids:
+            if not self.table.has(mms_id):
+                self.log.warning('%s: Not found in the data table, use "saturn add" to add it', mms_id)
+                continue
+            timings: Dict[str, float] = {}
+            try:
+                outcome = self.update_record(mms_id, update_urns, update_marc_record, timings)
+                n_validated += 1
+            except Exception:
+                self.log.exception('%s: Validation failed', mms_id)
+                outcome = 'error'
+                n_failed += 1
+            if progress is not None:
+                progress.record(mms_id, outcome, timings, self.institution)
+        self.log.info('Validated %d records, %d failed', n_validated, n_failed)
+        return n_validated, n_failed
+
+    def audit(self, confirm: bool) -> Dict[str, Any]:
+        """
+        Check the data table for duplicates, unexpected URLs and missing fields, and return a report.
 
-    def validate_records(self, update_urns: bool, update_marc_record: bool) -> None:
+        Params:
+            confirm: Whether to look up flagged rows in Alma and the URN service
+        """
+        auditor = Auditor(self.table, self.alma['iz'].delivery_url_template)
+        report = auditor.audit()
+        if confirm:
+            auditor.confirm(report, self.alma['iz'], self.urn)
+        return report
+
+    def for_institution(self, name: str) -> 'Saturn':
         """
-        Validate all records and makes updates as needed
+        Return a Saturn instance for one of the configured institutions.
+        The URN service client and the network zone client are shared with this instance.
         """
-        for row in self.table.rows:
-            self.update_record(row['alma_iz_id'], update_urns, update_marc_record)
-        log.info('Validated %d records', len(self.table.rows))
+        profile = self.institutions[name]
+        cfg = dict(self.cfg, default_data_file=profile['data_file'], alma_iz=profile['alma_iz'], institutions={},
+                   institution=name)
+        return Saturn(cfg, urn=self.urn, alma_nz=self.alma['nz'])
+
+    def validate_institution(self, saturn: 'Saturn', update_urns: bool, update_marc_record: bool,
+                             progress: Optional[ProgressReporter] = None) -> Dict[str, Any]:
+        """
+        Validate all records for one of the configured institutions and return a report.
+        The institution's table must already be open.
+        """
+        saturn.log.info('Validating %d records from %s', len(saturn.table.rows), saturn.default_data_file)
+        try:
+            n_validated, n_failed = saturn.validate_records(update_urns, update_marc_record, progress=progress)
+        except Exception as err:  # Don't let one institution stop the others
+            saturn.log.exception('Validation failed')
+            return {'institution': saturn.institution, 'validated': 0, 'failed': 0, 'error': str(err)}
+        return {'institution': saturn.institution, 'validated': n_validated, 'failed': n_failed, 'error': None}
+
+    def validate_institutions(self, update_urns: bool, update_marc_record: bool,
+                              progress: Optional[ProgressReporter] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Validate all configured institutions in parallel and log a combined report.
+        """
+        # Load the tables before starting the threads, since Table.open toggles the
+        # garbage collector for the whole process.
+        saturns = {name: self.for_institution(name) for name in self.institutions}
+        for saturn in saturns.values():
+            saturn.table.open(saturn.default_data_file)
+
+        with ThreadPoolExecutor(max_workers=len(saturns)) as executor:
+            futures = {
+                name: executor.submit(self.validate_institution, saturn, update_urns, update_marc_record, progress)
+                for name, saturn in saturns.items()
+            }
+        report = {name: future.result() for name, future in futures.items()}
+
+        log.info('Validation report:')
+        for name, result in report.items():
+            if result['error'] is None:
+                log.info('  %s: Validated %d records, %d failed', name, result['validated'], result['failed'])
+            else:
+                log.error('  %s: Failed: %s', name, result['error'])
+        log.info('  Total: Validated %d records, %d failed, in %d institutions',
+                 sum(result['validated'] for result in report.values()),
+                 sum(result['failed'] for result in report.values()), len(report))
+        return report
 
     def get_or_create_urn(self, bib: 'Bib', url: str) -> str:
         """
@@ -207,28 +475,32 @@ class Saturn(object):
         """
         urn = bib.marc_record.get_urn()
         if urn is not None:
-            log.info('Record already had URN: %s', urn)
+            self.log.info('Record already had URN: %s', urn)
             return urn
 
-        log.info('Creating URN pointing to %s', url)
+        self.log.info('Creating URN pointing to %s', url)
         return self.urn.create(url)
 
-    def add_urn_to_marc_record(self, bib: 'Bib', new_urn: str) -> None:
+    def add_urn_to_marc_record(self, bib: 'Bib', new_urn: str) -> bool:
         """
         Add URN to Alma MARC record in 024 $2 urn
+        Returns True if the record was updated, False if it already had an URN or the update
+        was skipped. Raises HTTPError if saving the record fails.
         """
         urn = bib.marc_record.get_urn()
         if urn is not None:
             if urn != new_urn:
-                log.error('URN mismatch for record %s: %s != %s', bib.id, urn, new_urn)
-            return
+                self.log.error('URN mismatch for record %s: %s != %s', bib.id, urn, new_urn)
+            return False
 
         field = bib.marc_record.add_datafield('024', '7', '0')
         field.add_subfield('a', new_urn)
         field.add_subfield('2', 'urn')
 
-        bib.alma.put_record(bib, show_diff=True)
-        log.info('Added URN %s to MARC record %s', new_urn, bib.id)
+        if not bib.alma.put_record(bib, show_diff=True, raise_errors=True):
+            return False
+        self.log.info('Added URN %s to MARC record %s', new_urn, bib.id)
+        return True
 
 
 def main() -> None:
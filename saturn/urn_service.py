@@ -1,5 +1,6 @@
 from zeep import Client as SoapClient  # type: ignore
 import logging
+import threading
 
 log = logging.getLogger(__name__)
 
@@ -13,18 +14,23 @@ class UrnService(object):
         self.session_token = None
         self.username = username
         self.password = password
+        self.login_lock = threading.Lock()
+
+    def login(self) -> None:
+        # The service may be shared between threads, so make sure we only log in once
+        with self.login_lock:
+            if self.session_token is None:
+                self.session_token = self.service.login(self.username, self.password)
 
     def create(self, url: str) -> str:
-        if self.session_token is None:
-            self.session_token = self.service.login(self.username, self.password)
+        self.login()
 
         info = self.service.createURN(self.session_token, self.series, url)
         log.info('Created new URN: %s', info['URN'])
         return str(info['URN'])
 
     def update(self, urn: str, old_url: str, new_url: str) -> None:
-        if self.session_token is None:
-            self.session_token = self.service.login(self.username, self.password)
+        self.login()
 
         info = self.service.replaceURL(self.session_token, urn, old_url, new_url)
         if info['URN'] != urn:
@@ -1,9 +1,12 @@
 # coding=utf-8
 from __future__ import unicode_literals
 import difflib
+import logging
+import threading
+import time
 from colorama import Fore  # type: ignore
 from lxml import etree  # type: ignore
-from typing import List, Iterator, Iterable
+from typing import Any, List, Iterator, Iterable, MutableMapping, Tuple
 
 
 def color_diff(diff: Iterable[str]) -> Iterator[str]:
@@ -38,3 +41,29 @@ def get_diff(src: str, dst: str) -> List[str]:
         difflib.unified_diff(src_lines, dst_lines, fromfile='Original', tofile='Modified')
     ))
 
+
+class InstitutionLogAdapter(logging.LoggerAdapter):
+    """ Prefixes log messages with the institution name, if there is one """
+
+    def process(self, msg: Any, kwargs: MutableMapping[str, Any]) -> Tuple[Any, MutableMapping[str, Any]]:
+        institution = (self.extra or {}).get('institution')
+        if institution is None:
+            return msg, kwargs
+        return '[%s] %s' % (institution, msg), kwargs
+
+
+class RateLimiter(object):
+    """ Limits calls to at most `rate` per second, shared across threads """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,190 @@
+# coding=utf-8
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from requests import Response
+from requests.exceptions import HTTPError
+
+from saturn import alma as alma_module
+from saturn.alma import Alma
+
+
+def test_cz_prompts_are_serialized(monkeypatch):
+    active = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def ask():
+        with lock:
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(1)
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return False  # Don't update the record
+
+    monkeypatch.setattr(alma_module.questionary, 'confirm', lambda question, default: SimpleNamespace(ask=ask))
+    clients = [Alma('eu', 'key-%d' % i, name='inst%d' % i) for i in range(4)]
+    record = SimpleNamespace(id='991', cz_id='123')
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda client: client.put_record(record), clients))
+
+    assert overlaps == []
+
+
+class FakeRecord(object):
+
+    def __init__(self, cz_id=None):
+        self.id = '991'
+        self.cz_id = cz_id
+        self.orig_xml = '<bib/>'
+        self.saved_xml = None
+
+    def xml(self):
+        return '<bib/>'
+
+    def init(self, xml):
+        self.saved_xml = xml
+
+
+def fake_put(status_code):
+    def put(url, data, headers):
+        response = Response()
+        response.status_code = status_code
+        response._content = b'<bib>saved</bib>'
+        return response
+    return put
+
+
+def test_put_record_returns_true_when_saved(monkeypatch):
+    client = Alma('eu', 'key')
+    monkeypatch.setattr(client.session, 'put', fake_put(200))
+    record = FakeRecord()
+    assert client.put_record(record) is True
+    assert record.saved_xml == '<bib>saved</bib>'
+
+
+def test_put_record_returns_false_on_dry_run(monkeypatch):
+    client = Alma('eu', 'key', dry_run=True)
+    monkeypatch.setattr(client.session, 'put', lambda *args, **kwargs: pytest.fail('Should not save'))
+    assert client.put_record(FakeRecord()) is False
+
+
+def test_put_record_returns_false_when_cz_update_is_declined(monkeypatch):
+    client = Alma('eu', 'key')
+    monkeypatch.setattr(alma_module.questionary, 'confirm',
+                        lambda question, default: SimpleNamespace(ask=lambda: False))
+    monkeypatch.setattr(client.session, 'put', lambda *args, **kwargs: pytest.fail('Should not save'))
+    assert client.put_record(FakeRecord(cz_id='123')) is False
+
+
+def test_put_record_http_error(monkeypatch):
+    client = Alma('eu', 'key')
+    monkeypatch.setattr(client.session, 'put', fake_put(500))
+    assert client.put_record(FakeRecord()) is False
+    with pytest.raises(HTTPError):
+        client.put_record(FakeRecord(), raise_errors=True)
+
+
+class FakeSetSession(object):
+    """ Serves set members from a list, and records the requested pages """
+
+    def __init__(self, members, total=None, fail_at_offset=None):
+        self.headers = {}
+        self.members = members
+        self.total = len(members) if total is None else total
+        self.fail_at_offset = fail_at_offset
+        self.requests = []
+
+    def __call__(self):
+        return self
+
+    def get(self, url, params):
+        self.requests.append((url, params['limit'], params['offset']))
+        response = Response()
+        if params['offset'] == self.fail_at_offset:
+            response.status_code = 500
+            response._content = b'Server error'
+            return response
+        page = self.members[params['offset']:params['offset'] + params['limit']]
+        data = {'total_record_count': self.total}
+        if len(page) > 0:
+            data['member'] = [{'id': mms_id, 'description': 'Title'} for mms_id in page]
+        response.status_code = 200
+        response._content = json.dumps(data).encode('utf-8')
+        return response
+
+
+def make_set_client(monkeypatch, session):
+    client = Alma('eu', 'key')
+    monkeypatch.setattr(alma_module, 'Session', session)
+    return client
+
+
+def test_get_set_members_pages(monkeypatch):
+    members = [str(990000 + i) for i in range(250)]
+    session = FakeSetSession(members)
+    client = make_set_client(monkeypatch, session)
+
+    assert list(client.get_set_members('123')) == members
+    assert session.requests == [
+        ('https://api-eu.hosted.exlibrisgroup.com/almaws/v1/conf/sets/123/members', 100, 0),
+        ('https://api-eu.hosted.exlibrisgroup.com/almaws/v1/conf/sets/123/members', 100, 100),
+        ('https://api-eu.hosted.exlibrisgroup.com/almaws/v1/conf/sets/123/members', 100, 200),
+    ]
+    assert session.headers['Authorization'] == 'apikey key'
+    assert session.headers['Accept'] == 'application/json'
+
+
+def test_get_set_members_stops_at_total_record_count(monkeypatch):
+    session = FakeSetSession([str(i) for i in range(200)])
+    client = make_set_client(monkeypatch, session)
+
+    assert len(list(client.get_set_members('123'))) == 200
+    assert [offset for url, limit, offset in session.requests] == [0, 100]
+
+
+def test_get_set_members_empty_set(monkeypatch):
+    # Alma leaves out 'member' for an empty set
+    session = FakeSetSession([])
+    client = make_set_client(monkeypatch, session)
+
+    assert list(client.get_set_members('123')) == []
+    assert [offset for url, limit, offset in session.requests] == [0]
+
+
+def test_get_set_members_stops_on_empty_page(monkeypatch):
+    # The set shrank while we were paging through it
+    session = FakeSetSession([str(i) for i in range(100)], total=300)
+    client = make_set_client(monkeypatch, session)
+
+    assert len(list(client.get_set_members('123'))) == 100
+    assert [offset for url, limit, offset in session.requests] == [0, 100]
+
+
+def test_get_set_members_is_lazy(monkeypatch):
+    session = FakeSetSession([str(i) for i in range(250)])
+    client = make_set_client(monkeypatch, session)
+
+    members = client.get_set_members('123')
+    assert next(members) == '0'
+    # The next page may be prefetched, but not the last one
+    assert 200 not in [offset for url, limit, offset in session.requests]
+    members.close()
+
+
+def test_get_set_members_http_error_on_later_page(monkeypatch):
+    session = FakeSetSession([str(i) for i in range(250)], fail_at_offset=100)
+    client = make_set_client(monkeypatch, session)
+
+    received = []
+    with pytest.raises(HTTPError):
+        for mms_id in client.get_set_members('123'):
+            received.append(mms_id)
+    assert received == [str(i) for i in range(100)]
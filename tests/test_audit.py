@@ -0,0 +1,83 @@
+# coding=utf-8
+from types import SimpleNamespace
+
+from saturn.audit import Auditor
+from saturn.data import Table, FIELDNAMES
+
+HEADER = ','.join(FIELDNAMES)
+TEMPLATE = 'https://example.org/delivery/{mms_id}'
+
+
+def open_table(tmpdir, text):
+    filename = str(tmpdir.join('data.csv'))
+    with open(filename, 'w', newline='') as fp:
+        fp.write(HEADER + '\n' + text)
+    return Table().open(filename)
+
+
+def issues_by_type(report):
+    return {issue['type']: issue for issue in report['issues']}
+
+
+def test_audit_clean_table(tmpdir):
+    table = open_table(tmpdir, 'URN:NBN:no-1,991,,221,https://example.org/delivery/991,T1\n'
+                               'URN:NBN:no-2,992,,222,https://example.org/delivery/992,T2\n')
+    report = Auditor(table, TEMPLATE).audit()
+    assert report['rows'] == 2
+    assert report['issues'] == []
+    assert report['summary'] == {}
+
+
+def test_audit_row_numbers(tmpdir):
+    # The first row spans two lines and is followed by a blank line, so the
+    # duplicate URN is on row 2, but on line 5 in the file.
+    table = open_table(tmpdir, 'URN:NBN:no-1,991,,221,https://example.org/delivery/991,"Two\nlines"\n'
+                               '\n'
+                               'URN:NBN:no-1,992,,222,https://example.org/delivery/992,T2\n')
+    issue = issues_by_type(Auditor(table, TEMPLATE).audit())['duplicate_urn']
+    assert issue['row_numbers'] == [1, 2]
+    assert issue['alma_iz_ids'] == ['991', '992']
+    assert issue['value'] == 'URN:NBN:no-1'
+
+
+def test_audit_finds_issues(tmpdir):
+    table = open_table(tmpdir, 'URN:NBN:no-1,991,981,221,https://example.org/delivery/991,T1\n'
+                               'URN:NBN:no-2,992,981,222,https://example.org/delivery/991,T2\n'
+                               'URN:NBN:no-3,991,,223,https://example.org/delivery/991,\n')
+    report = Auditor(table, TEMPLATE).audit()
+    issues = issues_by_type(report)
+
+    assert issues['duplicate_alma_iz_id']['row_numbers'] == [1, 3]
+    assert issues['duplicate_alma_nz_id']['row_numbers'] == [1, 2]
+    assert issues['duplicate_url']['row_numbers'] == [1, 2, 3]
+    assert issues['url_mismatch']['row_numbers'] == [2]
+    assert issues['url_mismatch']['expected_url'] == 'https://example.org/delivery/992'
+    assert issues['missing_fields']['row_numbers'] == [3]
+    assert issues['missing_fields']['fields'] == ['title']
+    assert 'duplicate_urn' not in issues
+
+
+def test_confirm(tmpdir):
+    table = open_table(tmpdir, 'URN:NBN:no-1,991,,221,https://example.org/delivery/991,T1\n'
+                               'URN:NBN:no-1,992,,222,https://example.org/delivery/992,T2\n'
+                               'URN:NBN:no-3,993,,223,https://example.org/delivery/993,T3\n')
+    auditor = Auditor(table, TEMPLATE)
+    report = auditor.audit()
+
+    def get_records(mms_ids):
+        return [
+            SimpleNamespace(id=mms_id, marc_record=SimpleNamespace(get_urn=lambda: 'URN:NBN:no-1'))
+            for mms_id in mms_ids if mms_id != '992'
+        ]
+
+    alma = SimpleNamespace(get_records=get_records)
+    urn = SimpleNamespace(get_url=lambda value: 'https://example.org/delivery/991')
+    auditor.confirm(report, alma, urn)
+
+    confirmations = report['confirmations']
+    assert [c['row_number'] for c in confirmations] == [1, 2]
+    assert confirmations[0]['alma_exists'] is True
+    assert confirmations[0]['alma_urn_matches'] is True
+    assert confirmations[0]['urn_target_matches'] is True
+    assert confirmations[1]['alma_exists'] is False
+    assert confirmations[1]['urn_target_matches'] is False
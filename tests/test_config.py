@@ -0,0 +1,63 @@
+# coding=utf-8
+import pytest
+
+from saturn.config import config
+
+ENV_KEYS = [
+    'SATURN_INSTITUTIONS', 'ALMA_API_KEY_NZ', 'ALMA_RATE_LIMIT_NZ',
+    'ALMA_API_KEY_UBO', 'ALMA_API_REGION_UBO', 'ALMA_DELIVERY_URL_TEMPLATE_UBO', 'ALMA_RATE_LIMIT_UBO',
+    'SATURN_DATA_FILE_UBO', 'ALMA_API_KEY_UBB', 'ALMA_API_REGION_UBB', 'ALMA_DELIVERY_URL_TEMPLATE_UBB',
+    'ALMA_RATE_LIMIT_UBB', 'SATURN_DATA_FILE_UBB',
+]
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for key in ENV_KEYS:
+        monkeypatch.delenv(key, raising=False)
+    return monkeypatch
+
+
+def test_no_institutions(env):
+    assert config()['institutions'] == {}
+
+
+def test_institutions(env):
+    env.setenv('SATURN_INSTITUTIONS', ' ubo, UBB,,')
+    env.setenv('ALMA_API_KEY_UBO', 'ubo-key')
+    env.setenv('ALMA_API_REGION_UBO', 'na')
+    env.setenv('ALMA_DELIVERY_URL_TEMPLATE_UBO', 'https://example.org/ubo/{mms_id}')
+    env.setenv('ALMA_RATE_LIMIT_UBO', '2.5')
+    env.setenv('SATURN_DATA_FILE_UBO', 'ubo.csv')
+    env.setenv('ALMA_API_KEY_UBB', 'ubb-key')
+    env.setenv('ALMA_RATE_LIMIT_UBB', '')
+
+    institutions = config()['institutions']
+    assert list(institutions) == ['ubo', 'UBB']
+    assert institutions['ubo'] == {
+        'data_file': 'ubo.csv',
+        'alma_iz': {
+            'api_region': 'na',
+            'api_key': 'ubo-key',
+            'delivery_url_template': 'https://example.org/ubo/{mms_id}',
+            'rate_limit': 2.5,
+        },
+    }
+    # Defaults
+    assert institutions['UBB'] == {
+        'data_file': 'saturn-data-ubb.csv',
+        'alma_iz': {
+            'api_region': 'eu',
+            'api_key': 'ubb-key',
+            'delivery_url_template': None,
+            'rate_limit': None,
+        },
+    }
+
+
+def test_network_zone_rate_limit(env):
+    assert config()['alma_nz']['rate_limit'] is None
+    env.setenv('ALMA_RATE_LIMIT_NZ', '')
+    assert config()['alma_nz']['rate_limit'] is None
+    env.setenv('ALMA_RATE_LIMIT_NZ', '10')
+    assert config()['alma_nz']['rate_limit'] == 10.0
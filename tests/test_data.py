@@ -0,0 +1,217 @@
+# coding=utf-8
+import csv
+
+import pytest
+
+from saturn.data import Table, RowNotFound, FIELDNAMES
+
+HEADER = ','.join(FIELDNAMES)
+URL_PREFIX = 'https://bibsys.alma.exlibrisgroup.com/view/delivery/47BIBSYS_UBO/'
+
+
+def dictreader_rows(filename):
+    # The rows as the old DictReader-based Table would see them, with missing values as ''
+    with open(filename) as fp:
+        return [{key: row.get(key) or '' for key in FIELDNAMES} for row in csv.DictReader(fp)]
+
+
+def dictwriter_output(tmpdir, rows):
+    # The file the old DictWriter-based Table.save would produce for the given rows
+    filename = str(tmpdir.join('expected.csv'))
+    with open(filename, 'w') as fp:
+        writer = csv.DictWriter(fp, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(filename) as fp:
+        return fp.read()
+
+
+def write_csv(tmpdir, text, name='data.csv'):
+    filename = str(tmpdir.join(name))
+    with open(filename, 'w', newline='') as fp:
+        fp.write(text)
+    return filename
+
+
+def read_file(filename):
+    with open(filename) as fp:
+        return fp.read()
+
+
+def test_open_nonexistent_file(tmpdir):
+    table = Table().open(str(tmpdir.join('missing.csv')))
+    assert len(table.rows) == 0
+    assert not table.has('1')
+
+
+def test_open_matches_dictreader(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\n' + ''.join(
+        'URN:NBN:no-%d,99%d,98%d,22%d,%s99%d,Title %d\n' % (i, i, i, i, URL_PREFIX, i, i)
+        for i in range(5)
+    ))
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+    assert list(table.tuples()) == [tuple(row[key] for key in FIELDNAMES) for row in dictreader_rows(filename)]
+
+
+def test_open_reordered_header(tmpdir):
+    filename = write_csv(tmpdir, 'title,url,alma_representation_id,alma_nz_id,alma_iz_id,urn\n'
+                                 'T1,%s991,221,981,991,URN:NBN:no-1\n' % URL_PREFIX)
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+
+
+def test_open_missing_columns(tmpdir):
+    filename = write_csv(tmpdir, 'urn,alma_iz_id\nURN:NBN:no-1,991\n')
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+    assert table.rows[0]['url'] == ''
+
+
+def test_open_blank_lines_and_short_rows(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\n'
+                                          'URN:NBN:no-1,991,,221,%s991,T1\n'
+                                          '\n'
+                                          'URN:NBN:no-2,992\n'
+                                          '\n' % URL_PREFIX)
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+    assert len(table.rows) == 2
+
+
+def test_open_multiline_quoted_title(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\n'
+                                          'URN:NBN:no-1,991,,221,%s991,"A title\nspanning, two lines"\n'
+                                          'URN:NBN:no-2,992,,222,%s992,T2\n' % (URL_PREFIX, URL_PREFIX))
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+    assert table.rows[0]['title'] == 'A title\nspanning, two lines'
+
+
+def test_open_urls_without_common_prefix(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\n'
+                                          'URN:NBN:no-1,991,,221,https://a.example.org/x/991,T1\n'
+                                          'URN:NBN:no-2,992,,222,http://b.example.org/992,T2\n'
+                                          'URN:NBN:no-3,993,,223,,T3\n'
+                                          'URN:NBN:no-4,994,,224,no-slash,T4\n')
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+
+
+def test_open_in_chunks(tmpdir, monkeypatch):
+    monkeypatch.setattr('saturn.data.CHUNK_SIZE', 2)
+    filename = write_csv(tmpdir, HEADER + '\n'
+                                          'URN:NBN:no-1,991,,221,%s991,T1\n'
+                                          'URN:NBN:no-2,992,,222,https://other.example.org/992,T2\n'
+                                          '\n'
+                                          'URN:NBN:no-3,993,,223,%s993,T3\n' % (URL_PREFIX, URL_PREFIX))
+    table = Table().open(filename)
+    assert [dict(row) for row in table.rows] == dictreader_rows(filename)
+
+
+def test_save_matches_dictwriter(tmpdir):
+    filename = write_csv(tmpdir, 'urn,title,alma_iz_id\n'
+                                 'URN:NBN:no-1,"A title\nspanning, two lines",991\n'
+                                 '\n'
+                                 'URN:NBN:no-2,T2\n')
+    table = Table().open(filename)
+    table.save(str(tmpdir.join('saved.csv')))
+    assert read_file(str(tmpdir.join('saved.csv'))) == dictwriter_output(tmpdir, dictreader_rows(filename))
+
+
+def test_save_roundtrip(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\r\n'
+                                          'URN:NBN:no-1,991,981,221,%s991,"Quoted, title"\r\n'
+                                          'URN:NBN:no-2,992,,222,https://other.example.org/992,T2\r\n' % URL_PREFIX)
+    table = Table().open(filename)
+    table.save()
+    assert read_file(filename) == dictwriter_output(tmpdir, dictreader_rows(filename))
+    assert [dict(row) for row in Table().open(filename).rows] == [dict(row) for row in table.rows]
+
+
+def test_save_without_filename():
+    with pytest.raises(ValueError):
+        Table().save()
+
+
+def test_set_value_url_changes_prefix(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\n'
+                                          'URN:NBN:no-1,991,,221,%s991,T1\n'
+                                          'URN:NBN:no-2,992,,222,%s992,T2\n' % (URL_PREFIX, URL_PREFIX))
+    table = Table().open(filename)
+    row = table.rows[0]
+    row['url'] = 'https://other.example.org/view/991'
+    assert row['url'] == 'https://other.example.org/view/991'
+    assert table.rows[1]['url'] == URL_PREFIX + '992'
+    row['url'] = 'no-slash'
+    assert row['url'] == 'no-slash'
+    row['url'] = ''
+    assert row['url'] == ''
+
+    table.save()
+    assert [r['url'] for r in Table().open(filename).rows] == ['', URL_PREFIX + '992']
+
+
+def test_set_value_other_fields(tmpdir):
+    table = Table().open(write_csv(tmpdir, HEADER + '\nURN:NBN:no-1,991,,221,%s991,T1\n' % URL_PREFIX))
+    row = table.get('991')
+    row['alma_nz_id'] = '981'
+    row['title'] = 'New title'
+    assert dict(table.get('991')) == {
+        'urn': 'URN:NBN:no-1',
+        'alma_iz_id': '991',
+        'alma_nz_id': '981',
+        'alma_representation_id': '221',
+        'url': URL_PREFIX + '991',
+        'title': 'New title',
+    }
+    with pytest.raises(KeyError):
+        row['unknown'] = 'value'
+    with pytest.raises(KeyError):
+        row['unknown']
+
+
+def test_set_value_alma_iz_id_updates_index(tmpdir):
+    table = Table().open(write_csv(tmpdir, HEADER + '\nURN:NBN:no-1,991,,221,%s991,T1\n' % URL_PREFIX))
+    assert table.has('991')
+    table.get('991')['alma_iz_id'] = '995'
+    assert not table.has('991')
+    assert table.get('995')['urn'] == 'URN:NBN:no-1'
+
+
+def test_has_and_get(tmpdir):
+    table = Table().open(write_csv(tmpdir, HEADER + '\n'
+                                                    'URN:NBN:no-1,991,,221,,T1\n'
+                                                    'URN:NBN:no-2,991,,222,,T2\n'
+                                                    'URN:NBN:no-3,993,,223,,T3\n'))
+    assert table.has('993')
+    assert not table.has('994')
+    # Like the old linear scan, the first matching row wins
+    assert table.get('991')['urn'] == 'URN:NBN:no-1'
+    with pytest.raises(RowNotFound):
+        table.get('994')
+
+
+def test_add(tmpdir):
+    filename = write_csv(tmpdir, HEADER + '\nURN:NBN:no-1,991,,221,%s991,T1\n' % URL_PREFIX)
+    table = Table().open(filename)
+    row = table.add('992')
+    assert dict(row) == {key: '992' if key == 'alma_iz_id' else '' for key in FIELDNAMES}
+    assert table.has('992')
+    row['urn'] = 'URN:NBN:no-2'
+    assert table.get('992')['urn'] == 'URN:NBN:no-2'
+    assert [r['alma_iz_id'] for r in Table().open(filename).rows] == ['991', '992']
+
+    with pytest.raises(ValueError):
+        table.add('991')
+
+
+def test_add_keeps_index(tmpdir):
+    table = Table().open(write_csv(tmpdir, HEADER + '\nURN:NBN:no-1,991,,221,,T1\n'))
+    assert table.has('991')
+    index = table.index
+    table.add('992', store=False)
+    table.add('993', store=False)
+    assert table.index is index
+    assert table.get('993')['alma_iz_id'] == '993'
+    assert table.get('991')['urn'] == 'URN:NBN:no-1'
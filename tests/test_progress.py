@@ -0,0 +1,67 @@
+# coding=utf-8
+import io
+import json
+import time
+
+from saturn.progress import ProgressReporter, timed
+
+
+def read_metrics(filename):
+    metrics = {}
+    with open(filename) as fp:
+        for line in fp:
+            if not line.startswith('#'):
+                key, value = line.rsplit(' ', 1)
+                metrics[key] = float(value)
+    return metrics
+
+
+def test_timed():
+    timings = {}
+    with timed(timings, 'phase'):
+        time.sleep(0.01)
+    with timed(timings, 'phase'):
+        pass
+    assert timings['phase'] >= 0.01
+
+
+def test_jsonl_events():
+    stream = io.StringIO()
+    progress = ProgressReporter(stream=stream)
+    progress.expect(3)
+    progress.record('991', 'ok', {'alma_get': 0.1})
+    progress.record('992', 'error', {}, institution='ubo')
+    progress.close()
+
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [event['event'] for event in events] == ['record', 'record', 'summary']
+    assert events[0]['mms_id'] == '991'
+    assert events[0]['outcome'] == 'ok'
+    assert events[0]['timings'] == {'alma_get': 0.1}
+    assert 'institution' not in events[0]
+    assert events[1]['institution'] == 'ubo'
+    assert events[1]['processed'] == 2
+    assert events[1]['errors'] == 1
+    assert events[2]['outcomes']['ok'] == 1
+    assert events[2]['outcomes']['error'] == 1
+
+
+def test_metrics_rate_drops_when_stalled(tmpdir):
+    filename = str(tmpdir.join('saturn.prom'))
+    progress = ProgressReporter(metrics_file=filename, metrics_interval=0.1, window=0.5)
+    progress.expect(10)
+    for i in range(5):
+        progress.record(str(i), 'ok', {})
+
+    time.sleep(0.3)
+    metrics = read_metrics(filename)
+    assert metrics['saturn_records_processed_total{outcome="ok"}'] == 5
+    assert metrics['saturn_records_per_second'] > 0
+    assert 'saturn_eta_seconds' in metrics
+
+    # No records for longer than the window
+    time.sleep(1.0)
+    metrics = read_metrics(filename)
+    assert metrics['saturn_records_per_second'] == 0
+    assert 'saturn_eta_seconds' not in metrics
+    progress.close()
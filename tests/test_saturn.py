@@ -0,0 +1,215 @@
+# coding=utf-8
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+from requests import Response
+from requests.exceptions import HTTPError
+
+from saturn.data import FIELDNAMES, Table
+from saturn.saturn import Saturn
+
+HEADER = ','.join(FIELDNAMES)
+
+
+def make_config(data_file, institutions=None):
+    return {
+        'default_data_file': data_file,
+        'urn': {},
+        'alma_iz': {
+            'api_region': 'eu',
+            'api_key': 'iz-key',
+            'delivery_url_template': 'https://example.org/delivery/{mms_id}',
+        },
+        'alma_nz': {
+            'api_region': 'eu',
+            'api_key': 'nz-key',
+        },
+        'institutions': institutions or {},
+    }
+
+
+def write_data_file(tmpdir, mms_ids, name='saturn-data.csv'):
+    filename = str(tmpdir.join(name))
+    with open(filename, 'w') as fp:
+        fp.write(HEADER + '\n')
+        for mms_id in mms_ids:
+            fp.write('URN:NBN:no-%s,%s,,22%s,https://example.org/delivery/%s,Title\n' % (mms_id, mms_id, mms_id, mms_id))
+    return filename
+
+
+def run(monkeypatch, saturn, *args):
+    monkeypatch.setattr(sys, 'argv', ['saturn'] + list(args))
+    saturn.run()
+
+
+def test_validate_exits_with_error_if_a_record_fails(tmpdir, monkeypatch):
+    filename = write_data_file(tmpdir, ['991', '992'])
+    saturn = Saturn(make_config(filename), urn=SimpleNamespace())
+    validated = []
+
+    def update_record(mms_id, update_urns, update_marc_record, timings=None):
+        if mms_id == '991':
+            raise RuntimeError('No digital representations found!')
+        validated.append(mms_id)
+        return 'ok'
+
+    monkeypatch.setattr(saturn, 'update_record', update_record)
+    with pytest.raises(SystemExit) as exc:
+        run(monkeypatch, saturn, 'validate')
+    assert exc.value.code == 1
+    assert validated == ['992']
+
+
+def test_validate_exits_normally_if_all_records_pass(tmpdir, monkeypatch):
+    filename = write_data_file(tmpdir, ['991', '992'])
+    saturn = Saturn(make_config(filename), urn=SimpleNamespace())
+    monkeypatch.setattr(saturn, 'update_record', lambda *args, **kwargs: 'ok')
+    run(monkeypatch, saturn, 'validate')
+    assert saturn.validate_records(False, False) == (2, 0)
+
+
+def test_institution_log_lines_are_tagged(tmpdir, caplog):
+    institutions = {'ubo': {'data_file': write_data_file(tmpdir, ['991'], 'ubo.csv'), 'alma_iz': make_config('')['alma_iz']}}
+    urn = SimpleNamespace(get_url=lambda urn: 'https://example.org/delivery/991')
+    saturn = Saturn(make_config(write_data_file(tmpdir, []), institutions), urn=urn)
+    ubo = saturn.for_institution('ubo')
+    assert ubo.urn is urn
+    with caplog.at_level('INFO'):
+        ubo.check_urn_target('URN:NBN:no-991', 'https://example.org/delivery/991', False)
+        saturn.check_urn_target('URN:NBN:no-991', 'https://example.org/delivery/991', False)
+    assert caplog.messages == [
+        '[ubo] URN:NBN:no-991 has the expected target URL',
+        'URN:NBN:no-991 has the expected target URL',
+    ]
+
+
+@pytest.mark.parametrize('key', ['api_key', 'delivery_url_template'])
+def test_all_institutions_requires_complete_profiles(tmpdir, monkeypatch, capsys, key):
+    alma_iz = dict(make_config('')['alma_iz'], **{key: None})
+    institutions = {'ubo': {'data_file': write_data_file(tmpdir, ['991'], 'ubo.csv'), 'alma_iz': alma_iz}}
+    saturn = Saturn(make_config(write_data_file(tmpdir, []), institutions), urn=SimpleNamespace())
+    monkeypatch.setattr(saturn, 'validate_institutions', lambda *args: pytest.fail('Should not start validation'))
+    with pytest.raises(SystemExit) as exc:
+        run(monkeypatch, saturn, 'validate', '--all-institutions')
+    assert exc.value.code == 2
+    assert '_UBO' in capsys.readouterr().err
+
+
+def http_error(status_code, text):
+    response = Response()
+    response.status_code = status_code
+    response._content = text.encode('utf-8')
+    return HTTPError(response=response)
+
+
+def test_add_set_skips_failing_records(tmpdir, monkeypatch):
+    saturn = Saturn(make_config(write_data_file(tmpdir, [])), urn=SimpleNamespace())
+    monkeypatch.setattr(saturn.alma['iz'], 'get_set_members', lambda set_id: iter(['991', '992', '993']))
+    monkeypatch.setattr(saturn.alma['iz'], 'get_record', lambda mms_id: None)
+    updated = []
+
+    def update_record(mms_id, update_urns, update_marc_record, store=True):
+        if mms_id == '991':
+            raise RuntimeError('No digital representations found!')
+        if mms_id == '992':
+            raise http_error(500, 'Server error')
+        updated.append(mms_id)
+
+    monkeypatch.setattr(saturn, 'update_record', update_record)
+    with pytest.raises(SystemExit) as exc:
+        run(monkeypatch, saturn, 'add', '--set', '123')
+    assert exc.value.code == 1
+    assert updated == ['993']
+
+
+@pytest.mark.parametrize('action', ['add', 'validate'])
+def test_set_fetch_error(tmpdir, monkeypatch, caplog, action):
+    saturn = Saturn(make_config(write_data_file(tmpdir, ['991'])), urn=SimpleNamespace())
+
+    def get_set_members(set_id):
+        raise http_error(400, 'Set not found')
+        yield
+
+    monkeypatch.setattr(saturn.alma['iz'], 'get_set_members', get_set_members)
+    with pytest.raises(SystemExit) as exc:
+        run(monkeypatch, saturn, action, '--set', '123')
+    assert exc.value.code == 1
+    assert 'Failed to fetch members of set 123. Alma API returned error 400 Set not found' in caplog.messages
+
+
+@pytest.mark.parametrize('saved', [True, False])
+def test_add_urn_to_marc_record_reports_whether_record_was_saved(tmpdir, saved):
+    saturn = Saturn(make_config(write_data_file(tmpdir, [])), urn=SimpleNamespace())
+    field = SimpleNamespace(add_subfield=lambda code, value: None)
+    bib = SimpleNamespace(
+        id='991',
+        marc_record=SimpleNamespace(get_urn=lambda: None, add_datafield=lambda tag, ind1, ind2: field),
+        alma=SimpleNamespace(put_record=lambda bib, show_diff, raise_errors: saved),
+    )
+    assert saturn.add_urn_to_marc_record(bib, 'URN:NBN:no-1') is saved
+
+
+def test_add_set_saves_periodically(tmpdir, monkeypatch):
+    monkeypatch.setattr('saturn.saturn.SAVE_INTERVAL', 10)
+    saturn = Saturn(make_config(write_data_file(tmpdir, [])), urn=SimpleNamespace())
+    monkeypatch.setattr(saturn.alma['iz'], 'get_record', lambda mms_id: None)
+    monkeypatch.setattr(saturn, 'update_record', lambda *args, **kwargs: 'ok')
+    saves = []
+    monkeypatch.setattr(saturn.table, 'save', lambda: saves.append(len(saturn.table.rows)))
+
+    assert saturn.add_records((str(991 + i) for i in range(25)), False, False) == (25, 0)
+    assert saves == [10, 20, 25]
+
+
+@pytest.mark.parametrize('args', [['--urn', 'URN:NBN:no-1'], ['991', '992']])
+def test_add_set_rejects_other_records(tmpdir, monkeypatch, capsys, args):
+    saturn = Saturn(make_config(write_data_file(tmpdir, [])), urn=SimpleNamespace())
+    monkeypatch.setattr(saturn, 'add_records', lambda *args, **kwargs: pytest.fail('Should not add records'))
+    with pytest.raises(SystemExit) as exc:
+        run(monkeypatch, saturn, 'add', '--set', '123', *args)
+    assert exc.value.code == 2
+    assert 'cannot be combined with --set' in capsys.readouterr().err
+
+
+def test_validate_institutions(tmpdir, monkeypatch, caplog):
+    names = ['ubo', 'ubb', 'ubt']
+    institutions = {
+        name: {'data_file': write_data_file(tmpdir, ['991'], '%s.csv' % name), 'alma_iz': make_config('')['alma_iz']}
+        for name in names
+    }
+    saturn = Saturn(make_config(write_data_file(tmpdir, []), institutions), urn=SimpleNamespace())
+
+    # Every institution has to wait for the others, so this only passes if they run concurrently
+    barrier = threading.Barrier(len(names), timeout=5)
+    results = {'ubo': (10, 1), 'ubt': (5, 0)}
+
+    def validate_records(self, update_urns, update_marc_record, mms_ids=None, progress=None):
+        barrier.wait()
+        if self.institution == 'ubb':
+            raise RuntimeError('Alma is down')
+        return results[self.institution]
+
+    # Table.open toggles the garbage collector, so tables must be loaded before the threads start
+    opened_in = []
+    table_open = Table.open
+
+    def open_table(self, filename):
+        opened_in.append(threading.current_thread())
+        return table_open(self, filename)
+
+    monkeypatch.setattr(Saturn, 'validate_records', validate_records)
+    monkeypatch.setattr(Table, 'open', open_table)
+    with caplog.at_level('INFO'):
+        report = saturn.validate_institutions(False, False)
+
+    assert opened_in == [threading.main_thread()] * len(names)
+
+    assert report == {
+        'ubo': {'institution': 'ubo', 'validated': 10, 'failed': 1, 'error': None},
+        'ubb': {'institution': 'ubb', 'validated': 0, 'failed': 0, 'error': 'Alma is down'},
+        'ubt': {'institution': 'ubt', 'validated': 5, 'failed': 0, 'error': None},
+    }
+    assert '[ubb] Validation failed' in caplog.messages
+    assert '  Total: Validated 15 records, 1 failed, in 3 institutions' in caplog.messages
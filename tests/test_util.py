@@ -0,0 +1,30 @@
+# coding=utf-8
+import threading
+import time
+
+from saturn.util import RateLimiter
+
+
+def test_rate_limiter_spacing():
+    limiter = RateLimiter(20)
+    calls = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(3):
+            limiter.wait()
+            with lock:
+                calls.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    calls.sort()
+    assert len(calls) == 9
+    # The first call is not delayed, the others are spaced 1/20 s apart
+    assert calls[-1] - calls[0] >= 8 * 0.05 - 0.01
+    for previous, current in zip(calls, calls[1:]):
+        assert current - previous >= 0.05 - 0.01